@@ -1,14 +1,45 @@
+import asyncio
+import functools
+import heapq
+import logging
 import os
-import json
 import re
+import sqlite3
 import unicodedata
-import xmlrpc.client
+from contextlib import asynccontextmanager
 from typing import Any, Dict, List, Optional, Union
 
+import httpx
+import orjson
+from cachetools import TTLCache
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel, Field
 
-app = FastAPI(title="Odoo Readonly Gateway", version="1.0.0")
+class ORJSONResponse(JSONResponse):
+    """JSON response rendered with orjson (FastAPI's own ORJSONResponse is deprecated)."""
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global uid
+    uid = await _authenticate()
+    _TEMPLATE_CACHE.clear()
+    _FIELDS_CACHE.clear()
+    refresher = asyncio.create_task(_refresh_product_index()) if PRODUCT_INDEX_REFRESH > 0 else None
+    yield
+    if refresher:
+        refresher.cancel()
+    await client.aclose()
+
+app = FastAPI(
+    title="Odoo Readonly Gateway",
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
+)
 
 # -----------------------
 # Env
@@ -17,44 +48,90 @@ ODOO_URL = os.getenv("ODOO_URL")
 ODOO_DB = os.getenv("ODOO_DB")
 ODOO_USERNAME = os.getenv("ODOO_USERNAME")
 ODOO_API_KEY = os.getenv("ODOO_API_KEY")
+# Seconds to wait for an Odoo answer; unset = no limit (big search_read can be slow)
+ODOO_TIMEOUT = float(os.getenv("ODOO_TIMEOUT") or 0) or None
 
 if not all([ODOO_URL, ODOO_DB, ODOO_USERNAME, ODOO_API_KEY]):
     raise RuntimeError("Missing one of ODOO_URL, ODOO_DB, ODOO_USERNAME, ODOO_API_KEY")
 
 # -----------------------
-# Odoo XML-RPC clients
+# Odoo JSON-RPC client
 # -----------------------
-common = xmlrpc.client.ServerProxy(f"{ODOO_URL}/xmlrpc/2/common")
-uid = common.authenticate(ODOO_DB, ODOO_USERNAME, ODOO_API_KEY, {})
-if not uid:
-    raise RuntimeError("Odoo authentication failed (check DB/username/API key).")
+# One shared async HTTP client for every Odoo call (authenticate included):
+# JSON-RPC payloads (orjson in and out, much cheaper than XML-RPC marshalling)
+# are POSTed to /jsonrpc over a pooled keep-alive connection.
+client = httpx.AsyncClient(
+    base_url=ODOO_URL,
+    http2=True,
+    # httpx defaults to 5s for everything; only bound the connection attempt
+    timeout=httpx.Timeout(ODOO_TIMEOUT, connect=10),
+    limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+)
+
+# Set once at startup by _authenticate() (see lifespan)
+uid: Optional[int] = None
 
-models = xmlrpc.client.ServerProxy(f"{ODOO_URL}/xmlrpc/2/object")
+class OdooFault(Exception):
+    """Error returned by Odoo in the JSON-RPC "error" member."""
+
+    def __init__(self, error: Dict[str, Any]):
+        data = error.get("data") or {}
+        self.faultString = data.get("message") or error.get("message") or str(error)
+        super().__init__(self.faultString)
+
+async def _jsonrpc(service: str, method: str, args: List[Any]) -> Any:
+    body = orjson.dumps({
+        "jsonrpc": "2.0",
+        "method": "call",
+        "params": {"service": service, "method": method, "args": args},
+    })
+    resp = await client.post("/jsonrpc", content=body, headers={"Content-Type": "application/json"})
+    resp.raise_for_status()
+    payload = orjson.loads(resp.content)
+    if payload.get("error"):
+        raise OdooFault(payload["error"])
+    return payload.get("result")
+
+async def _authenticate() -> int:
+    user_id = await _jsonrpc("common", "authenticate", [ODOO_DB, ODOO_USERNAME, ODOO_API_KEY, {}])
+    if not user_id:
+        raise RuntimeError("Odoo authentication failed (check DB/username/API key).")
+    return user_id
 
 # -----------------------
 # Read-only enforcement
 # -----------------------
 ALLOWED_METHODS = {"search_read", "read", "fields_get", "name_search"}
 
-def _odoo_call(model: str, method: str, args: List[Any], kwargs: Dict[str, Any]) -> Any:
+async def _odoo_call(model: str, method: str, args: List[Any], kwargs: Dict[str, Any]) -> Any:
     if method not in ALLOWED_METHODS:
         raise HTTPException(status_code=403, detail=f"Method not allowed: {method}")
     try:
-        return models.execute_kw(ODOO_DB, uid, ODOO_API_KEY, model, method, args, kwargs)
-    except xmlrpc.client.Fault as e:
+        return await _jsonrpc(
+            "object",
+            "execute_kw",
+            [ODOO_DB, uid, ODOO_API_KEY, model, method, args, kwargs],
+        )
+    except OdooFault as e:
         raise HTTPException(status_code=400, detail=f"Odoo Fault: {e.faultString}")
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Server error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Server error: {str(e) or type(e).__name__}")
 
 # -----------------------
 # Helpers
 # -----------------------
+_WS_RE = re.compile(r"\s+")
+# str.translate table deleting every combining mark (accents left over by NFKD)
+_COMBINING = dict.fromkeys(c for c in range(0x110000) if unicodedata.combining(chr(c)))
+
+@functools.lru_cache(maxsize=4096)
 def _normalize(s: str) -> str:
-    s = (s or "").strip().lower()
-    s = unicodedata.normalize("NFKD", s)
-    s = "".join(c for c in s if not unicodedata.combining(c))
-    s = re.sub(r"\s+", " ", s)
-    return s
+    s = s or ""
+    # ASCII has nothing for NFKD / accent stripping to do: only lower + collapse spaces
+    if s.isascii():
+        return " ".join(s.lower().split())
+    s = unicodedata.normalize("NFKD", s.strip().lower()).translate(_COMBINING)
+    return _WS_RE.sub(" ", s)
 
 def _parse_domain(domain: Union[str, List[Any], None]) -> List[Any]:
     """
@@ -63,16 +140,16 @@ def _parse_domain(domain: Union[str, List[Any], None]) -> List[Any]:
     - a python-like list passed by actions as structured JSON
     - None -> []
     """
-    if domain is None:
-        return []
     if isinstance(domain, list):
         return domain
+    if domain is None:
+        return []
     if isinstance(domain, str):
         d = domain.strip()
         if not d:
             return []
         try:
-            return json.loads(d)
+            return orjson.loads(d)
         except Exception:
             raise HTTPException(status_code=400, detail="domain must be JSON (stringified) or a JSON list.")
     raise HTTPException(status_code=400, detail="domain must be JSON (string) or list.")
@@ -84,40 +161,166 @@ def _parse_fields(fields: Union[str, List[str], None]) -> List[str]:
     - JSON list ["id","name"]
     - None -> []
     """
-    if fields is None:
-        return []
     if isinstance(fields, list):
         return fields
+    if fields is None:
+        return []
     if isinstance(fields, str):
         f = fields.strip()
         if not f:
             return []
         # try json list first
-        if f.startswith("["):
+        if f[0] == "[":
             try:
-                return json.loads(f)
+                return orjson.loads(f)
             except Exception:
                 pass
-        return [x.strip() for x in f.split(",") if x.strip()]
+        return [x for x in (p.strip() for p in f.split(",")) if x]
     raise HTTPException(status_code=400, detail="fields must be a comma-separated string or JSON list.")
 
+def _query_tokens(q: str) -> List[str]:
+    """
+    Normalized search tokens of q (2+ chars), or the whole normalized query if none.
+    """
+    qn = _normalize(q)
+    # dict.fromkeys: drop repeated tokens (keeps order), each one is an extra ilike for Odoo
+    tokens = list(dict.fromkeys(t for t in qn.split(" ") if len(t) >= 2))
+    return tokens or [qn]
+
 def _token_or_domain(field: str, q: str) -> List[Any]:
     """
     Build OR domain for tokens: (field ilike tok1) OR (field ilike tok2) OR ...
     """
-    qn = _normalize(q)
-    tokens = [t for t in qn.split(" ") if len(t) >= 2]
-    if not tokens:
-        tokens = [qn]
+    tokens = _query_tokens(q)
+    # OR chain: ["|","|", cond1, cond2, cond3] (a single token needs no "|")
+    return ["|"] * (len(tokens) - 1) + [[field, "ilike", tok] for tok in tokens]
+
+# -----------------------
+# Local product index
+# -----------------------
+# In-memory SQLite FTS5 copy of every product.template (id, name, priority),
+# refreshed in the background every PRODUCT_INDEX_REFRESH seconds (0 disables
+# it). Names are stored pre-normalized and indexed by trigram, so the token OR
+# search of _token_or_domain runs locally (accent-insensitive) without an Odoo
+# round-trip, in Odoo's own "priority desc, name" order.
+# Each uvicorn worker keeps its own copy: Odoo serves one paged catalog
+# download per worker and per refresh, so raise the interval with the worker count.
+PRODUCT_INDEX_REFRESH = int(os.getenv("PRODUCT_INDEX_REFRESH", "600"))
+# Rows per search_read page when downloading the catalog
+PRODUCT_INDEX_PAGE_SIZE = 1000
+# Queries with more tokens go to Odoo: one UNION branch per token, and SQLite
+# caps a compound SELECT at 500 terms
+PRODUCT_INDEX_MAX_TOKENS = 100
+
+logger = logging.getLogger(__name__)
+
+# Built by _refresh_product_index() (None until the first successful load)
+_index: Optional[sqlite3.Connection] = None
+_LIKE_SPECIAL_RE = re.compile(r"([\\%_])")
+
+def _build_index(rows: List[Dict[str, Any]]) -> sqlite3.Connection:
+    """
+    Build a fresh index from search_read rows (runs in a worker thread).
+    """
+    # bypass the lru_cache: a full catalog would just evict the hot query names
+    normalize = _normalize.__wrapped__
+    db = sqlite3.connect(":memory:", check_same_thread=False)
+    db.execute("CREATE VIRTUAL TABLE products USING fts5(name UNINDEXED, priority UNINDEXED, norm, tokenize='trigram')")
+    with db:
+        db.executemany(
+            "INSERT INTO products(rowid, name, priority, norm) VALUES (?, ?, ?, ?)",
+            ((r["id"], r["name"], r.get("priority") or "0", normalize(r["name"])) for r in rows),
+        )
+    return db
+
+async def _fetch_catalog() -> List[Dict[str, Any]]:
+    # priority (favorites) only exists on recent Odoo versions
+    available = await _odoo_call("product.template", "fields_get", [], {"attributes": ["type"]})
+    fields = ["id", "name"] + (["priority"] if "priority" in available else [])
+    rows: List[Dict[str, Any]] = []
+    last_id = 0
+    while True:
+        # keyset pagination on id: stable even if products change meanwhile
+        page = await _odoo_call(
+            "product.template",
+            "search_read",
+            [[["id", ">", last_id]]],
+            {"fields": fields, "order": "id", "limit": PRODUCT_INDEX_PAGE_SIZE},
+        )
+        rows.extend(page)
+        if len(page) < PRODUCT_INDEX_PAGE_SIZE:
+            return rows
+        last_id = page[-1]["id"]
 
-    if len(tokens) == 1:
-        return [[field, "ilike", tokens[0]]]
+async def _refresh_product_index() -> None:
+    global _index
+    while True:
+        try:
+            rows = await _fetch_catalog()
+            # build off the event loop, then swap in one step
+            new_index = await asyncio.to_thread(_build_index, rows)
+            old_index, _index = _index, new_index
+            if old_index is not None:
+                old_index.close()
+        except sqlite3.OperationalError as e:
+            # e.g. SQLite built without FTS5 / trigram: keep searching Odoo directly
+            logger.warning("Product index disabled: %s", e)
+            return
+        except Exception as e:
+            # keep serving the previous snapshot (or Odoo directly if there is none)
+            logger.warning("Product index refresh failed: %s", getattr(e, "detail", e))
+        await asyncio.sleep(PRODUCT_INDEX_REFRESH)
+
+def _index_search(index: sqlite3.Connection, tokens: List[str], limit: int) -> List[Dict[str, Any]]:
+    # One single-LIKE select per token, UNIONed: FTS5 can only serve a lone LIKE
+    # from the trigram index (an OR of LIKEs, or any ESCAPE, scans the whole table).
+    selects: List[str] = []
+    params: List[Any] = []
+    for t in tokens:
+        if _LIKE_SPECIAL_RE.search(t):
+            # rare (%, _ or a backslash in the query): pay for the full scan only here
+            selects.append("SELECT rowid, name, priority, norm FROM products WHERE norm LIKE ? ESCAPE '\\'")
+            params.append("%" + _LIKE_SPECIAL_RE.sub(r"\\\1", t) + "%")
+        else:
+            selects.append("SELECT rowid, name, priority, norm FROM products WHERE norm LIKE ?")
+            params.append(f"%{t}%")
+    # sort on the normalized name (case- and accent-insensitive), closer to
+    # PostgreSQL's locale collation than SQLite's byte order on the raw name
+    rows = index.execute(
+        f"SELECT rowid, name FROM ({' UNION '.join(selects)}) ORDER BY priority DESC, norm, name LIMIT ?",
+        (*params, limit if limit > 0 else -1),
+    )
+    return [{"id": i, "name": name} for i, name in rows]
+
+# Short-lived cache of product.template candidates, keyed by (normalized query, limit).
+# Repeated lookups of the same product skip the Odoo round-trip entirely.
+_TEMPLATE_CACHE: TTLCache = TTLCache(maxsize=1024, ttl=30)
 
-    # OR chain: ["|","|", cond1, cond2, cond3]
-    dom: List[Any] = ["|"] * (len(tokens) - 1)
-    for tok in tokens:
-        dom.append([field, "ilike", tok])
-    return dom
+async def _search_templates(q: str, limit: int) -> List[Dict[str, Any]]:
+    tokens = _query_tokens(q)
+    if _index is not None and len(tokens) <= PRODUCT_INDEX_MAX_TOKENS:
+        try:
+            return _index_search(_index, tokens, limit)
+        except sqlite3.Error as e:
+            # never fail a valid query just because the index is loaded
+            logger.warning("Product index search failed, asking Odoo: %s", e)
+    key = (_normalize(q), limit)
+    cached = _TEMPLATE_CACHE.get(key)
+    if cached is not None:
+        return cached
+    results = await _odoo_call(
+        "product.template",
+        "search_read",
+        [_token_or_domain("name", q)],
+        {"fields": ["id", "name"], "limit": limit}
+    )
+    _TEMPLATE_CACHE[key] = results
+    return results
+
+# Model schemas barely ever change: keep fields_get answers for 5 minutes,
+# keyed by (model, attributes). Only context-free calls are cached since the
+# context (e.g. lang) changes the labels Odoo returns.
+_FIELDS_CACHE: TTLCache = TTLCache(maxsize=256, ttl=300)
 
 # -----------------------
 # Request/Response models
@@ -161,7 +364,7 @@ def health():
     return {"status": "running"}
 
 @app.post("/odoo/search_read")
-def odoo_search_read(req: SearchReadReq):
+async def odoo_search_read(req: SearchReadReq):
     domain = _parse_domain(req.domain)
     fields = _parse_fields(req.fields)
     kwargs: Dict[str, Any] = {
@@ -173,55 +376,122 @@ def odoo_search_read(req: SearchReadReq):
         kwargs["order"] = req.order
     if req.context:
         kwargs["context"] = req.context
-    return _odoo_call(req.model, "search_read", [domain], kwargs)
+    return await _odoo_call(req.model, "search_read", [domain], kwargs)
+
+# Rows per search_read page when streaming
+STREAM_PAGE_SIZE = 200
+
+@app.post("/odoo/search_read_stream")
+async def odoo_search_read_stream(req: SearchReadReq):
+    """
+    Same as /odoo/search_read but pages through Odoo and streams rows as NDJSON
+    (one JSON object per line), so large result sets are never held in memory.
+    limit <= 0 streams every matching row.
+    Errors on the first page return a normal HTTP error. If a later page fails,
+    the 200 is already sent: the stream then ends with one last line
+    {"error": "...", "status_code": ..., "rows_sent": n} instead of a row.
+    """
+    domain = _parse_domain(req.domain)
+    fields = _parse_fields(req.fields)
+    # stable order, otherwise pages can overlap or skip rows: id as the last key
+    # (PostgreSQL returns ties in any order from one OFFSET query to the next)
+    order = [part.strip() for part in (req.order or "").split(",") if part.strip()]
+    if "id" not in (part.split()[0] for part in order):
+        order.append("id")
+    kwargs: Dict[str, Any] = {"fields": fields, "order": ", ".join(order)}
+    if req.context:
+        kwargs["context"] = req.context
+    total = req.limit if req.limit > 0 else None
+
+    async def fetch(sent: int) -> List[Dict[str, Any]]:
+        size = STREAM_PAGE_SIZE if total is None else min(STREAM_PAGE_SIZE, total - sent)
+        return await _odoo_call(
+            req.model, "search_read", [domain], {**kwargs, "offset": req.offset + sent, "limit": size}
+        )
+
+    # First page is fetched before the response starts so Odoo errors still
+    # come back as a proper HTTP status instead of a truncated stream.
+    first = await fetch(0)
+
+    async def ndjson():
+        rows, sent = first, 0
+        while rows:
+            for row in rows:
+                yield orjson.dumps(row) + b"\n"
+            sent += len(rows)
+            if len(rows) < STREAM_PAGE_SIZE or (total is not None and sent >= total):
+                break
+            try:
+                rows = await fetch(sent)
+            except HTTPException as e:
+                # headers are gone: tell the client in-band that the stream is incomplete
+                yield orjson.dumps({"error": e.detail, "status_code": e.status_code, "rows_sent": sent}) + b"\n"
+                return
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
 
 @app.post("/odoo/read")
-def odoo_read(req: ReadReq):
+async def odoo_read(req: ReadReq):
     fields = _parse_fields(req.fields)
     kwargs: Dict[str, Any] = {"fields": fields}
     if req.context:
         kwargs["context"] = req.context
-    return _odoo_call(req.model, "read", [req.ids], kwargs)
+    return await _odoo_call(req.model, "read", [req.ids], kwargs)
 
 @app.post("/odoo/fields_get")
-def odoo_fields_get(req: FieldsGetReq):
+async def odoo_fields_get(req: FieldsGetReq):
     kwargs: Dict[str, Any] = {}
     if req.attributes:
         kwargs["attributes"] = req.attributes
     if req.context:
         kwargs["context"] = req.context
-    return _odoo_call(req.model, "fields_get", [], kwargs)
+        return await _odoo_call(req.model, "fields_get", [], kwargs)
+
+    key = (req.model, tuple(req.attributes or ()))
+    cached = _FIELDS_CACHE.get(key)
+    if cached is None:
+        cached = _FIELDS_CACHE[key] = await _odoo_call(req.model, "fields_get", [], kwargs)
+    return cached
 
 @app.post("/odoo/name_search")
-def odoo_name_search(req: NameSearchReq):
+async def odoo_name_search(req: NameSearchReq):
     domain = _parse_domain(req.domain)
     kwargs: Dict[str, Any] = {"limit": req.limit}
     if req.context:
         kwargs["context"] = req.context
-    return _odoo_call(req.model, "name_search", [req.name, domain], kwargs)
+    return await _odoo_call(req.model, "name_search", [req.name, domain], kwargs)
 
 # ✅ Résout ton problème "café noisette" / "noisette"
 # -> recherche tokenisée + sans accents + retourne candidats (id+name)
 @app.post("/odoo/find_product_templates")
-def find_product_templates(req: ProductSearchReq):
-    # On cherche par tokens sur le champ name (tolerant)
-    domain = _token_or_domain("name", req.q)
-
-    # Récup minimal
-    results = _odoo_call(
-        "product.template",
-        "search_read",
-        [domain],
-        {"fields": ["id", "name"], "limit": req.limit}
-    )
+async def find_product_templates(req: ProductSearchReq):
+    # On cherche par tokens sur le champ name (tolerant), récup minimal
+    results = await _search_templates(req.q, req.limit)
 
     # Petit bonus : on trie côté serveur pour mettre les meilleurs en haut (sans IA, juste heuristique)
     qn = _normalize(req.q)
+    tokens = tuple(t for t in qn.split(" ") if t)
     def rank(x: Dict[str, Any]) -> int:
         name = _normalize(x.get("name", ""))
         # score simple: nb de tokens présents
-        tokens = [t for t in qn.split(" ") if t]
         return sum(1 for t in tokens if t in name)
 
-    results.sort(key=rank, reverse=True)
-    return {"query": req.q, "results": results}
+    # top-k via heapq (même ordre que sorted(reverse=True)[:k]) ; ne modifie pas
+    # la liste, qui vient du cache partagé
+    # (limit <= 0 : Odoo renvoie tout, on garde tout)
+    k = req.limit if req.limit > 0 else len(results)
+    return {"query": req.q, "results": heapq.nlargest(k, results, key=rank)}
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(
+        "app:app",
+        host="0.0.0.0",
+        port=int(os.getenv("PORT", "10000")),
+        loop="auto",  # uvloop when installed (not on Windows), asyncio otherwise
+        http="httptools",
+        workers=int(os.getenv("WEB_CONCURRENCY", "4")),
+        backlog=2048,
+        limit_concurrency=1000,
+    )